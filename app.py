@@ -1,22 +1,55 @@
 from flask import Flask, request, redirect, session, render_template_string, url_for
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyOAuth
 import os
 import threading
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from new_music import run_recommendation_script  # your existing script
+from clients import get_http_session, get_spotify_client, save_token
+from db import db_connect, db_release
+
+# Keep the web tier thin: spotipy, psycopg2 and the recommendation engine
+# (new_music, which pulls in selenium/bs4) are imported where they're used.
+# clients and db load psycopg2 and spotipy lazily as well.
 
 # ----------------- Flask Setup -----------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET", "dev_secret")
 
-SPOTIFY_CLIENT_ID = os.environ["SPOTIFY_CLIENT_ID"]
-SPOTIFY_CLIENT_SECRET = os.environ["SPOTIFY_CLIENT_SECRET"]
-SPOTIFY_REDIRECT_URI = os.environ.get("BASE_URL") + "/spotify_auth"
 SCOPE = "playlist-modify-public playlist-modify-private user-library-read"
 
-DB_URL = os.environ.get("DATABASE_URL")  # Postgres connection string
+def get_spotify_oauth():
+    """Builds the OAuth helper, reading Spotify config on first use rather than at import."""
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyOAuth
+    return SpotifyOAuth(
+        os.environ["SPOTIFY_CLIENT_ID"],
+        os.environ["SPOTIFY_CLIENT_SECRET"],
+        os.environ["BASE_URL"] + "/spotify_auth",
+        scope=SCOPE,
+        cache_handler=MemoryCacheHandler(),
+        requests_session=get_http_session("spotify")
+    )
+
+def start_prewarm():
+    """
+    Loads the recommendation engine and warms its browser/DB pool in the
+    background when PREWARM_WORKER is set, so the first job doesn't pay for it.
+    """
+    if os.environ.get("PREWARM_WORKER", "").lower() not in ("1", "true", "yes"):
+        return
+
+    def prewarm_job():
+        import new_music
+        new_music.prewarm(start_browser=os.environ.get("PREWARM_BROWSER", "1").lower() in ("1", "true", "yes"))
+
+    threading.Thread(target=prewarm_job, daemon=True).start()
+
+def start_notification_dispatcher():
+    """
+    Runs the SMS outbox dispatcher in this process. On by default; set
+    NOTIFY_DISPATCHER=0 when a separate `python notifications.py` sends them.
+    """
+    if os.environ.get("NOTIFY_DISPATCHER", "1").lower() not in ("1", "true", "yes"):
+        return
+    from notifications import run_dispatcher
+    threading.Thread(target=run_dispatcher, daemon=True).start()
 
 # ----------------- Templates -----------------
 INDEX_HTML = """
@@ -25,7 +58,7 @@ INDEX_HTML = """
 <head><title>Music Recs</title></head>
 <body>
     <h1>Grayson's Enhanced Music Recs</h1>
-    {% if 'access_token' in session %}
+    {% if 'spotify_user_id' in session %}
         <p>Logged in as Spotify user.</p>
         <a href="{{ url_for('setup_page') }}"><button>Go to Setup</button></a>
         <form action="{{ url_for('logout') }}" method="POST">
@@ -75,7 +108,7 @@ SETUP_HTML = """
 # ----------------- Database Functions -----------------
 def save_user_and_playlist(spotify_user_id, display_name, playlist_id, artists_dict):
     """Save user info and artists to Postgres"""
-    conn = psycopg2.connect(DB_URL)
+    conn = db_connect()
     cur = conn.cursor()
 
     # Insert or update user
@@ -97,7 +130,7 @@ def save_user_and_playlist(spotify_user_id, display_name, playlist_id, artists_d
 
     conn.commit()
     cur.close()
-    conn.close()
+    db_release(conn)
 
 # ----------------- Flask Routes -----------------
 @app.route("/")
@@ -106,31 +139,36 @@ def index():
 
 @app.route("/login")
 def login():
-    sp_oauth = SpotifyOAuth(
-        SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI, scope=SCOPE
-    )
+    sp_oauth = get_spotify_oauth()
     return redirect(sp_oauth.get_authorize_url())
 
 @app.route("/spotify_auth")
 def spotify_auth_callback():
-    sp_oauth = SpotifyOAuth(
-        SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI, scope=SCOPE
-    )
+    sp_oauth = get_spotify_oauth()
     code = request.args.get("code")
     token_info = sp_oauth.get_access_token(code, as_dict=True)
-    session["access_token"] = token_info["access_token"]
+
+    # The login token is brand new, so use it once to learn who this is and hand
+    # it to the shared token store; everything after goes through the store.
+    from spotipy import Spotify
+    sp = Spotify(auth=token_info["access_token"], requests_session=get_http_session("spotify"))
+    spotify_user_id = sp.current_user()["id"]
+    save_token(spotify_user_id, token_info["access_token"], token_info["refresh_token"], token_info["expires_at"])
+
+    # The session only identifies the user; access tokens live in the token store
     session["refresh_token"] = token_info["refresh_token"]
+    session["spotify_user_id"] = spotify_user_id
     return redirect(url_for("setup_page"))
 
 @app.route("/setup")
 def setup_page():
-    if "access_token" not in session:
+    if "spotify_user_id" not in session:
         return redirect(url_for("index"))
     return render_template_string(SETUP_HTML)
 
 @app.route("/run", methods=["POST"])
 def run_script():
-    if "access_token" not in session:
+    if "spotify_user_id" not in session:
         return "Not logged in with Spotify", 403
 
     phone = request.form.get("phone")
@@ -138,17 +176,17 @@ def run_script():
         return "Invalid phone number format. Use +15132268634 format.", 400
 
     playlist_url = request.form.get("playlist_url")  # optional
-    access_token = session["access_token"]
     refresh_token = session["refresh_token"]
+    spotify_user_id = session["spotify_user_id"]
 
     # Run script in background
     def background_job():
-        from spotipy import Spotify
-        sp = Spotify(auth=access_token)
+        from new_music import run_recommendation_script
+        # Token comes from the shared store, refreshed there if it has expired
+        sp = get_spotify_client(spotify_user_id, refresh_token)
 
         # Get current user info
         current_user = sp.current_user()
-        spotify_user_id = current_user["id"]
         display_name = current_user.get("display_name", spotify_user_id)
 
         # Determine playlist ID
@@ -159,7 +197,7 @@ def run_script():
             playlist_id = playlist["id"]
 
         # --- Save or update Spotify user in Postgres ---
-        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        conn = db_connect()
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO spotify_users (spotify_user_id, display_name, playlist_id)
@@ -170,10 +208,10 @@ def run_script():
         """, (spotify_user_id, display_name, playlist_id))
         conn.commit()
         cur.close()
-        conn.close()
+        db_release(conn)
 
         # Run your recommendation script
-        run_recommendation_script(access_token, refresh_token, phone, playlist_id, spotify_user_id, display_name)
+        run_recommendation_script(refresh_token, phone, playlist_id, spotify_user_id, display_name)
 
     threading.Thread(target=background_job).start()
     return "🎵 Your personalized recommendations are being generated! You’ll get a text when it’s done."
@@ -185,4 +223,9 @@ def logout():
 
 # ----------------- Run App -----------------
 if __name__ == "__main__":
+    # The debug reloader runs this file twice: a watcher parent and the serving
+    # child (WERKZEUG_RUN_MAIN=true). Only the child starts background threads.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_prewarm()
+        start_notification_dispatcher()
     app.run(host="0.0.0.0", port=8000, debug=True)
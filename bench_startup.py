@@ -0,0 +1,44 @@
+"""
+Import-time benchmark for the web tier and the recommendation engine.
+
+Each import runs in a fresh interpreter so nothing is cached between samples.
+
+    python bench_startup.py            # 5 runs each
+    python bench_startup.py --runs 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ["app", "new_music"]
+
+TIMER = (
+    "import time; t = time.perf_counter(); "
+    "import {module}; "
+    "print(time.perf_counter() - t)"
+)
+
+def time_import(module):
+    out = subprocess.run(
+        [sys.executable, "-c", TIMER.format(module=module)],
+        capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        try:
+            samples = [time_import(module) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<12} failed to import: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<12} median {statistics.median(samples) * 1000:8.1f} ms   "
+              f"min {min(samples) * 1000:8.1f} ms   ({args.runs} runs)")
+
+if __name__ == "__main__":
+    main()
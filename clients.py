@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from db import db_connect, db_release, ensure_table
+
+# Shared by the web tier and the workers, so only requests is imported up front;
+# spotipy and psycopg2 are loaded on first use.
+
+SPOTIFY_SCOPE = "playlist-modify-public playlist-modify-private user-library-read"
+
+# Refresh this many seconds before Spotify says the token expires
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", "300"))
+
+# Connection pool size per upstream service
+HTTP_POOL_SIZES = {
+    "spotify": int(os.environ.get("SPOTIFY_POOL_SIZE", "16")),
+    "lastfm": int(os.environ.get("LASTFM_POOL_SIZE", "4")),
+    "notify": int(os.environ.get("NOTIFY_POOL_SIZE", "2")),
+}
+
+# ==== HTTP SESSIONS ====
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _retry_policy(service):
+    """
+    Spotify gets the same retries spotipy builds for its own sessions (429/5xx,
+    honouring Retry-After); spotipy skips that setup when handed a session.
+    """
+    if service != "spotify":
+        return 0
+    return Retry(
+        total=3,
+        connect=None,
+        read=False,
+        status=3,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status_forcelist=(429, 500, 502, 503, 504),
+        backoff_factor=0.3,
+        respect_retry_after_header=True
+    )
+
+class _SharedSession(requests.Session):
+    """
+    A process-wide session. spotipy's Spotify and auth objects close their
+    session when garbage-collected, which would drop every other thread's
+    keep-alive connections, so close() is a no-op here.
+    """
+
+    def close(self):
+        pass
+
+def get_http_session(service):
+    """
+    Returns the process-wide keep-alive session for a service ("spotify",
+    "lastfm", "notify"), sized by HTTP_POOL_SIZES.
+    """
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if session is None:
+            size = HTTP_POOL_SIZES.get(service, 4)
+            session = _SharedSession()
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=_retry_policy(service))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[service] = session
+    return session
+
+# ==== TOKEN STORE ====
+# Access tokens are cached per user in process and in the spotify_tokens table so
+# the web tier and workers share them; a token is only refreshed when it's within
+# TOKEN_REFRESH_MARGIN of expiring.
+
+_tokens = {}
+_token_locks = {}
+_token_locks_lock = threading.Lock()
+
+def _ensure_token_table():
+    ensure_table(
+        "spotify_tokens",
+        """
+        CREATE TABLE IF NOT EXISTS spotify_tokens (
+            spotify_user_id TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT NOT NULL,
+            expires_at BIGINT NOT NULL
+        )
+        """,
+    )
+
+def _user_lock(spotify_user_id):
+    with _token_locks_lock:
+        return _token_locks.setdefault(spotify_user_id, threading.Lock())
+
+def _db_execute(sql, params, fetch=False):
+    from psycopg2.extras import RealDictCursor
+    _ensure_token_table()
+    conn = db_connect()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(sql, params)
+        row = cur.fetchone() if fetch else None
+        cur.close()
+        return row
+    finally:
+        db_release(conn)
+
+def save_token(spotify_user_id, access_token, refresh_token, expires_at):
+    """
+    Stores a token (expires_at is a unix timestamp) in process and in Postgres.
+    A token is never replaced by one that expires earlier, so a stale copy from
+    one tier can't overwrite a newer one refreshed by another.
+    """
+    token = {"access_token": access_token, "refresh_token": refresh_token, "expires_at": int(expires_at)}
+    current = _tokens.get(spotify_user_id)
+    if not current or current["expires_at"] < token["expires_at"]:
+        _tokens[spotify_user_id] = token
+    try:
+        _db_execute("""
+            INSERT INTO spotify_tokens (spotify_user_id, access_token, refresh_token, expires_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (spotify_user_id) DO UPDATE
+            SET access_token = EXCLUDED.access_token,
+                refresh_token = EXCLUDED.refresh_token,
+                expires_at = EXCLUDED.expires_at
+            WHERE spotify_tokens.expires_at < EXCLUDED.expires_at
+        """, (spotify_user_id, access_token, refresh_token, int(expires_at)))
+    except Exception as e:
+        print(f"[WARN] Failed to persist token for {spotify_user_id}: {e}")
+    return token
+
+def _load_token(spotify_user_id):
+    try:
+        row = _db_execute("""
+            SELECT access_token, refresh_token, expires_at
+            FROM spotify_tokens WHERE spotify_user_id = %s
+        """, (spotify_user_id,), fetch=True)
+    except Exception as e:
+        print(f"[WARN] Failed to load token for {spotify_user_id}: {e}")
+        return None
+    return dict(row) if row else None
+
+def _is_fresh(token):
+    return token and token["expires_at"] - TOKEN_REFRESH_MARGIN > time.time()
+
+def _refresh_token(spotify_user_id, refresh_token):
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyOAuth
+    auth_manager = SpotifyOAuth(
+        client_id=os.environ.get("SPOTIFY_CLIENT_ID"),
+        client_secret=os.environ.get("SPOTIFY_CLIENT_SECRET"),
+        redirect_uri=(os.environ.get("BASE_URL") or "http://localhost:5000") + "/callback",
+        scope=SPOTIFY_SCOPE,
+        cache_handler=MemoryCacheHandler(),
+        requests_session=get_http_session("spotify")
+    )
+    token_info = auth_manager.refresh_access_token(refresh_token)
+    print(f"[INFO] Refreshed Spotify access token for {spotify_user_id}")
+    return save_token(
+        spotify_user_id,
+        token_info["access_token"],
+        # Spotify only sometimes rotates the refresh token
+        token_info.get("refresh_token") or refresh_token,
+        token_info["expires_at"]
+    )
+
+def get_access_token(spotify_user_id, refresh_token=None):
+    """
+    Returns a valid access token for the user: the in-process copy, then the
+    shared DB copy, and only refreshes with Spotify when both are near expiry.
+    refresh_token is used if the store doesn't have one for this user yet.
+    """
+    with _user_lock(spotify_user_id):
+        token = _tokens.get(spotify_user_id)
+        if _is_fresh(token):
+            return token["access_token"]
+
+        stored = _load_token(spotify_user_id)
+        if _is_fresh(stored):
+            _tokens[spotify_user_id] = stored
+            return stored["access_token"]
+
+        latest_refresh = (stored or token or {}).get("refresh_token") or refresh_token
+        if not latest_refresh:
+            raise RuntimeError(f"No Spotify refresh token available for {spotify_user_id}")
+        return _refresh_token(spotify_user_id, latest_refresh)["access_token"]
+
+class StoredTokenAuth:
+    """spotipy auth_manager that pulls each request's token from the token store."""
+
+    def __init__(self, spotify_user_id, refresh_token=None):
+        self.spotify_user_id = spotify_user_id
+        self.refresh_token = refresh_token
+
+    def get_access_token(self, as_dict=False):
+        return get_access_token(self.spotify_user_id, self.refresh_token)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_spotify_client(spotify_user_id, refresh_token=None):
+    """Long-lived Spotify client for a user on the shared "spotify" session."""
+    from spotipy import Spotify
+    with _clients_lock:
+        client = _clients.get(spotify_user_id)
+        if client is None:
+            client = Spotify(
+                auth_manager=StoredTokenAuth(spotify_user_id, refresh_token),
+                requests_session=get_http_session("spotify")
+            )
+            _clients[spotify_user_id] = client
+        elif refresh_token:
+            client.auth_manager.refresh_token = refresh_token
+    return client
@@ -0,0 +1,68 @@
+import os
+import threading
+
+# Postgres access shared by the web tier and the workers. psycopg2 is imported
+# when the pool is first created so importing this module stays cheap.
+
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "5"))
+
+# ==== DATABASE POOL ====
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+# ThreadedConnectionPool raises instead of waiting when it's empty; the semaphore
+# makes extra callers block until a connection is returned.
+_db_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+def get_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            _db_pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, os.environ["DATABASE_URL"])
+    return _db_pool
+
+def db_connect():
+    _db_slots.acquire()
+    try:
+        return get_db_pool().getconn()
+    except Exception:
+        _db_slots.release()
+        raise
+
+def db_release(conn):
+    """Returns a connection to the pool, discarding any uncommitted work."""
+    try:
+        if not conn.closed:
+            conn.rollback()
+            conn.autocommit = False
+    finally:
+        get_db_pool().putconn(conn, close=bool(conn.closed))
+        _db_slots.release()
+
+# ==== SCHEMA ====
+
+_ready_tables = set()
+_ready_tables_lock = threading.Lock()
+
+def ensure_table(name, *statements):
+    """
+    Runs the DDL statements for `name` (CREATE TABLE IF NOT EXISTS, ADD COLUMN
+    IF NOT EXISTS, ...) once per process, on its own autocommit connection so a
+    caller's rollback can't undo it.
+    """
+    with _ready_tables_lock:
+        if name in _ready_tables:
+            return
+        conn = db_connect()
+        try:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for statement in statements:
+                cur.execute(statement)
+            cur.close()
+        finally:
+            db_release(conn)
+        _ready_tables.add(name)
@@ -1,25 +1,22 @@
 import os
 import random
+import sys
+import threading
 import time
-import psycopg2
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone, timedelta
-from random import choices
-import requests
-from spotipy import Spotify
+from itertools import islice
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from spotipy.exceptions import SpotifyException
-from psycopg2.extras import RealDictCursor
-from webdriver_manager.chrome import ChromeDriverManager
-
-# Selenium for scraping
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+from psycopg2.extras import RealDictCursor, Json
+from clients import get_http_session, get_spotify_client
+from notifications import enqueue_notification
+from db import db_connect, db_release, ensure_table, get_db_pool
+
+# Selenium and bs4 are imported inside the scraping helpers so runs that never
+# reach the scrape strategy (and the web tier) don't pay for them.
 
 # ==== CONFIG ====
 ARTISTS_FILE = "artists.json"
@@ -28,51 +25,107 @@ OUTPUT_PLAYLIST_ID = os.environ.get("PLAYLIST_ID")  # Spotify playlist to add tr
 LASTFM_API_KEY = os.environ.get("LASTFM_API_KEY")
 LASTFM_USERNAME = os.environ.get("LASTFM_USERNAME")
 
-SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID")
-SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET")
-SPOTIFY_REDIRECT_URI = (os.environ.get("BASE_URL") or "http://localhost:5000") + "/callback"
-SPOTIFY_REFRESH_TOKEN = os.environ.get("SPOTIFY_REFRESH_TOKEN")
-
-MY_PHONE = os.environ.get("MY_PHONE_NUMBER")
 SELFPING_API_KEY = os.environ.get("SELFPING_API_KEY")
 SELFPING_ENDPOINT = "https://www.selfping.com/api/sms"
 
 scope = "playlist-modify-public playlist-modify-private user-library-read"
 
 # ==== GLOBAL DRIVER FOR SCRAPING ====
+# One headless browser per process. It's closed at the end of each job unless
+# prewarm() ran, in which case it stays up for the next job. driver_lock guards
+# startup/shutdown and serializes page loads, since concurrent jobs share it.
 
 global_driver = None
+driver_lock = threading.RLock()
+keep_browser_warm = False
+
 def get_global_driver():
+    from selenium import webdriver
     from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
     global global_driver
-    if global_driver is None:
-        options = Options()
-        options.headless = True
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--remote-debugging-port=9222")
-        options.binary_location = os.environ.get("CHROME_BIN", "/usr/bin/chromium")
-        service = Service(os.environ.get("CHROMEDRIVER_PATH", "/usr/bin/chromedriver"))
-        try:
-            global_driver = webdriver.Chrome(service=service, options=options)
-        except WebDriverException as e:
-            print(f"[ERROR] Failed to start ChromeDriver: {e}")
-            raise
-    return global_driver
+    with driver_lock:
+        if global_driver is None:
+            options = Options()
+            options.headless = True
+            options.add_argument("--no-sandbox")
+            options.add_argument("--disable-dev-shm-usage")
+            options.add_argument("--disable-gpu")
+            options.add_argument("--remote-debugging-port=9222")
+            options.binary_location = os.environ.get("CHROME_BIN", "/usr/bin/chromium")
+            service = Service(os.environ.get("CHROMEDRIVER_PATH", "/usr/bin/chromedriver"))
+            try:
+                global_driver = webdriver.Chrome(service=service, options=options)
+            except WebDriverException as e:
+                print(f"[ERROR] Failed to start ChromeDriver: {e}")
+                raise
+        return global_driver
 
 def close_global_driver():
     global global_driver
-    if global_driver:
-        global_driver.quit()
-        global_driver = None
+    with driver_lock:
+        if global_driver:
+            try:
+                global_driver.quit()
+            except Exception as e:
+                # Quitting a crashed browser can fail; forget it either way
+                print(f"[WARN] Failed to quit headless browser: {e}")
+            finally:
+                global_driver = None
+
+def _driver_alive(driver):
+    try:
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+def release_global_driver():
+    """End-of-job hook: closes the browser unless it's being kept warm."""
+    if not keep_browser_warm:
+        close_global_driver()
+
+def prewarm(start_browser=True):
+    """
+    Optional hook for worker processes: opens the DB pool and starts the
+    headless browser before the first job so it doesn't pay the startup cost.
+    With start_browser the browser is then kept open between jobs.
+    """
+    started = time.monotonic()
+    try:
+        get_db_pool()
+        print("[INFO] Prewarmed DB connection pool")
+    except Exception as e:
+        print(f"[WARN] DB pool prewarm failed: {e}")
+    if start_browser:
+        global keep_browser_warm
+        keep_browser_warm = True
+        try:
+            get_global_driver()
+            print("[INFO] Prewarmed headless browser")
+        except Exception as e:
+            print(f"[WARN] Browser prewarm failed: {e}")
+    print(f"[INFO] Prewarm finished in {time.monotonic() - started:.2f}s")
 
 # ==== HELPER FUNCTIONS ====
 def safe_spotify_call(func, *args, **kwargs):
     time.sleep(.5)
+    return _spotify_call(func, *args, **kwargs)
+
+_spotify_call_state = threading.local()
+
+def last_spotify_error_status():
+    """HTTP status of this thread's last failed Spotify call, or None if it succeeded."""
+    return getattr(_spotify_call_state, "status", None)
+
+def _spotify_call(func, *args, **kwargs):
+    """safe_spotify_call without the fixed delay, for callers that pace themselves."""
+    _spotify_call_state.status = None
     try:
         return func(*args, **kwargs)
     except spotipy.exceptions.SpotifyException as e:
+        _spotify_call_state.status = e.http_status
         # Common transient or not-found cases
         if e.http_status == 404:
             print(f"[WARN] Spotify 404 for {func.__name__}: Resource not found")
@@ -86,8 +139,156 @@ def safe_spotify_call(func, *args, **kwargs):
         print(f"[WARN] Unexpected error in {func.__name__}: {e}")
         return None
 
+def make_rate_limiter(per_second):
+    """
+    Returns a wait() function that spaces calls at least 1/per_second apart
+    across all threads sharing it.
+    """
+    lock = threading.Lock()
+    next_slot = [time.monotonic()]
+
+    def wait_for_slot():
+        with lock:
+            now = time.monotonic()
+            slot = max(now, next_slot[0])
+            next_slot[0] = slot + 1.0 / per_second
+        time.sleep(max(0.0, slot - now))
+
+    return wait_for_slot
+
+
+# ==== NEGATIVE CACHE ====
+# Persistent record of dead ends (missing/empty playlists, playlists dominated by
+# the seed artist, artists over the follower cap) so later runs skip them
+# without an API call. Entries expire after a per-reason TTL; `value` holds the
+# observed number (track count, followers) so callers can compare to their own limit.
+
+NEGATIVE_CACHE_TTL_DAYS = {
+    "not_found": 30,
+    "empty": 7,
+    "artist_heavy": 14,
+    "over_followers": 7,
+}
+NEGATIVE_CACHE_MEMO_MAX = 50000
+# Misses are only remembered briefly so entries written by other workers show up
+NEGATIVE_CACHE_MISS_TTL_SECONDS = 60
+
+_negative_cache_memo = {}
+_negative_cache_lock = threading.Lock()
+
+def _ensure_negative_cache_table():
+    ensure_table(
+        "negative_cache",
+        """
+        CREATE TABLE IF NOT EXISTS negative_cache (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            value BIGINT,
+            expires_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+        """,
+    )
+
+def negative_cache_get(kind, key):
+    """
+    Returns the live entry {"reason", "value"} for (kind, key), or None.
+    Kinds: "playlist", "playlist_artist" (key "playlist_id:artist_id"), "artist".
+    Hits are memoized in-process until they expire, misses for
+    NEGATIVE_CACHE_MISS_TTL_SECONDS.
+    """
+    now = datetime.now(timezone.utc)
+    with _negative_cache_lock:
+        entry = _negative_cache_memo.get((kind, key))
+        if entry and entry["expires_at"] > now:
+            return entry if entry["reason"] else None
+
+    entry = None
+    conn = None
+    try:
+        _ensure_negative_cache_table()
+        conn = db_connect()
+        conn.autocommit = True
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT reason, value, expires_at FROM negative_cache
+            WHERE kind = %s AND key = %s AND expires_at > NOW()
+        """, (kind, key))
+        entry = cur.fetchone()
+        cur.close()
+    except Exception as e:
+        print(f"[WARN] Negative cache lookup failed for {kind} {key}: {e}")
+        return None
+    finally:
+        if conn is not None:
+            db_release(conn)
+
+    with _negative_cache_lock:
+        if len(_negative_cache_memo) >= NEGATIVE_CACHE_MEMO_MAX:
+            _negative_cache_memo.clear()
+        if entry:
+            _negative_cache_memo[(kind, key)] = dict(entry)
+        else:
+            _negative_cache_memo[(kind, key)] = {
+                "reason": None,
+                "value": None,
+                "expires_at": now + timedelta(seconds=NEGATIVE_CACHE_MISS_TTL_SECONDS),
+            }
+    return entry
+
+def negative_cache_put(kind, key, reason, value=None):
+    """Records a dead end for NEGATIVE_CACHE_TTL_DAYS[reason] days."""
+    expires_at = datetime.now(timezone.utc) + timedelta(days=NEGATIVE_CACHE_TTL_DAYS[reason])
+    with _negative_cache_lock:
+        _negative_cache_memo[(kind, key)] = {"reason": reason, "value": value, "expires_at": expires_at}
+
+    conn = None
+    try:
+        _ensure_negative_cache_table()
+        conn = db_connect()
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO negative_cache (kind, key, reason, value, expires_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (kind, key) DO UPDATE
+            SET reason = EXCLUDED.reason, value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+        """, (kind, key, reason, value, expires_at))
+        cur.close()
+    except Exception as e:
+        print(f"[WARN] Negative cache write failed for {kind} {key}: {e}")
+    finally:
+        if conn is not None:
+            db_release(conn)
+
+def is_dead_playlist(playlist_id):
+    entry = negative_cache_get("playlist", playlist_id)
+    if entry:
+        print(f"[CACHE] Skipping playlist {playlist_id} ({entry['reason']})")
+    return entry is not None
+
+def record_playlist_failure(playlist_id, playlist):
+    """Caches a playlist that came back empty or 404; transient errors aren't cached."""
+    if playlist is None:
+        if last_spotify_error_status() == 404:
+            negative_cache_put("playlist", playlist_id, "not_found")
+    elif not playlist.get("items"):
+        negative_cache_put("playlist", playlist_id, "empty")
+
+def is_artist_heavy_playlist(playlist_id, artist_id, max_tracks):
+    entry = negative_cache_get("playlist_artist", f"{playlist_id}:{artist_id}")
+    return entry is not None and entry["value"] is not None and entry["value"] > max_tracks
+
+def cached_follower_count(artist_id):
+    entry = negative_cache_get("artist", artist_id)
+    return entry["value"] if entry and entry["reason"] == "over_followers" else None
+
 
 def get_random_track_from_playlist(playlist_id, excluded_artist=None, max_followers=None, source_desc="", artists_data=None, existing_artist_ids=None):
+    if is_dead_playlist(playlist_id):
+        return None
+
     consecutive_invalid = 0
     for attempt in range(1, 21):
         try:
@@ -98,16 +299,19 @@ def get_random_track_from_playlist(playlist_id, excluded_artist=None, max_follow
             )
             if not playlist or "items" not in playlist:
                 print(f"[WARN] Playlist {playlist_id} is empty or inaccessible, skipping")
+                record_playlist_failure(playlist_id, playlist)
                 return None
         except SpotifyException as e:
             if e.http_status == 404:
                 print(f"[WARN] Playlist {playlist_id} not found or inaccessible, skipping...")
+                negative_cache_put("playlist", playlist_id, "not_found")
                 return None
             else:
                 raise
 
         if not playlist["items"]:
             print(f"[WARN] Playlist {playlist_id} is empty, skipping...")
+            record_playlist_failure(playlist_id, playlist)
             return None
 
         item = random.choice(playlist["items"])
@@ -134,61 +338,71 @@ def get_random_track_from_playlist(playlist_id, excluded_artist=None, max_follow
                 return None
 
 def scrape_artist_playlists(artist_id_or_url):
-    driver = get_global_driver()
-    playlists = []
-    try:
-        if "open.spotify.com/artist/" in artist_id_or_url:
-            url = f"{artist_id_or_url}/playlists"
-        else:
-            url = f"https://open.spotify.com/artist/{artist_id_or_url}/playlists"
-        driver.get(url)
-
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_all_elements_located((By.CSS_SELECTOR, "a[href*='/playlist/']"))
-        )
-        time.sleep(2)
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+    from bs4 import BeautifulSoup
+
+    with driver_lock:
+        driver = get_global_driver()
+        playlists = []
+        try:
+            if "open.spotify.com/artist/" in artist_id_or_url:
+                url = f"{artist_id_or_url}/playlists"
+            else:
+                url = f"https://open.spotify.com/artist/{artist_id_or_url}/playlists"
+            driver.get(url)
 
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        while True:
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "a[href*='/playlist/']"))
+            )
             time.sleep(2)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        playlist_elements = soup.select("a[href*='/playlist/']")
-        seen = set()
-        for pl in playlist_elements:
-            href = pl.get("href")
-            name = pl.text.strip()
-            if href and name and href not in seen:
-                playlists.append({"name": name, "url": "https://open.spotify.com" + href})
-                seen.add(href)
-        return playlists
-    except Exception as e:
-        print(f"[WARN] Error scraping artist playlists: {e}")
-        return playlists
 
-def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
-    track = None
-    seen_playlists = set()
+            last_height = driver.execute_script("return document.body.scrollHeight")
+            while True:
+                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                time.sleep(2)
+                new_height = driver.execute_script("return document.body.scrollHeight")
+                if new_height == last_height:
+                    break
+                last_height = new_height
+
+            soup = BeautifulSoup(driver.page_source, "html.parser")
+            playlist_elements = soup.select("a[href*='/playlist/']")
+            seen = set()
+            for pl in playlist_elements:
+                href = pl.get("href")
+                name = pl.text.strip()
+                if href and name and href not in seen:
+                    playlists.append({"name": name, "url": "https://open.spotify.com" + href})
+                    seen.add(href)
+            return playlists
+        except Exception as e:
+            print(f"[WARN] Error scraping artist playlists: {e}")
+            # A crashed or disconnected browser would fail every later scrape while
+            # it's kept warm; drop it so the next call starts a fresh one. A page
+            # that just never showed playlists (TimeoutException) leaves it alone.
+            crashed = isinstance(e, WebDriverException) and not isinstance(e, TimeoutException)
+            if crashed or not _driver_alive(driver):
+                print("[WARN] Restarting headless browser")
+                close_global_driver()
+            return playlists
+
+# ==== DISCOVERY STRATEGIES ====
+# Each strategy takes the same keyword arguments and returns a valid track or None.
+# Order is chosen per run from observed yield (see order_strategies).
+
+def _strategy_scraped_playlists(artist_name, artist_id, artists_data, existing_artist_ids, seen_playlists):
     playlist_attempts = 0
-
-    artist_results = safe_spotify_call(sp.search, artist_name, type="artist", limit=1)["artists"]["items"]
-    if not artist_results:
-        print(f"[WARN] No Spotify artist found for '{artist_name}'")
-        return None
-    artist_id = artist_results[0]["id"]
-
-    # Step 1: Scraped artist playlists
     scraped_artist_playlists = scrape_artist_playlists(artist_id)
     for pl in scraped_artist_playlists:
         playlist_id = pl["url"].split("/")[-1].split("?")[0]
         if playlist_id in seen_playlists:
             continue
         seen_playlists.add(playlist_id)
+        if is_dead_playlist(playlist_id) or is_artist_heavy_playlist(playlist_id, artist_id, 5):
+            continue
 
         try:
             playlist_items = safe_spotify_call(
@@ -202,6 +416,7 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
             )
             if not playlist_items or "items" not in playlist_items:
                 print(f"[WARN] Spotify 404 for playlist_items: {playlist_id}, skipping")
+                record_playlist_failure(playlist_id, playlist_items)
                 continue
 
         except spotipy.exceptions.SpotifyException as e:
@@ -219,6 +434,7 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
             )
 
         if artist_track_count > 5:
+            negative_cache_put("playlist_artist", f"{playlist_id}:{artist_id}", "artist_heavy", artist_track_count)
             continue
 
         playlist_attempts += 1
@@ -236,11 +452,11 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
         
         if track:
             return track
+    return None
 
-    # Step 2: User playlists via API
-    print(f"[INFO] No valid tracks found in artist playlists for '{artist_name}'. Trying user made playlists...")
-
-    user_playlists = safe_spotify_call(sp.search, artist_name, type="playlist", limit=20)["playlists"]["items"]
+def _strategy_user_playlists(artist_name, artist_id, artists_data, existing_artist_ids, seen_playlists):
+    search_results = safe_spotify_call(sp.search, artist_name, type="playlist", limit=20)
+    user_playlists = search_results["playlists"]["items"] if search_results else []
     for pl in user_playlists[:10]:
         if not pl or "id" not in pl:
             continue
@@ -248,6 +464,8 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
         if playlist_id in seen_playlists:
             continue
         seen_playlists.add(playlist_id)
+        if is_dead_playlist(playlist_id) or is_artist_heavy_playlist(playlist_id, artist_id, 10):
+            continue
 
         playlist_data = safe_spotify_call(
             sp.playlist_items, 
@@ -256,6 +474,7 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
         )
         if not playlist_data or "items" not in playlist_data:
             print(f"[WARN] Playlist {playlist_id} is empty or inaccessible, skipping")
+            record_playlist_failure(playlist_id, playlist_data)
             continue
         playlist_items = playlist_data["items"]
 
@@ -265,6 +484,7 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
             if item.get("track") and artist_name.lower() in [a["name"].lower() for a in item["track"]["artists"]]
         )
         if artist_track_count > 10:
+            negative_cache_put("playlist_artist", f"{playlist_id}:{artist_id}", "artist_heavy", artist_track_count)
             continue
 
         track = get_random_track_from_playlist(
@@ -278,14 +498,14 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
 
         if track:
             return track
+    return None
 
-    # Step 3: Last.fm similar artists
-    print(f"[INFO] No valid tracks found in scraped/user playlists for '{artist_name}'. Trying Last.fm similar artists...")
+def _strategy_lastfm_similar(artist_name, artist_id, artists_data, existing_artist_ids, seen_playlists):
     similar_artists = []
     url = "http://ws.audioscrobbler.com/2.0/"
     params = {"method": "artist.getsimilar", "artist": artist_name, "api_key": LASTFM_API_KEY, "format": "json", "limit": 10}
     try:
-        resp = requests.get(url, params=params)
+        resp = get_http_session("lastfm").get(url, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         similar_artists = [a["name"] for a in data.get("similarartists", {}).get("artist", [])]
@@ -294,7 +514,8 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
         similar_artists = []
     random.shuffle(similar_artists)
     for sim_artist in similar_artists[:10]:
-        artist_results = safe_spotify_call(sp.search, sim_artist, type="artist", limit=1)["artists"]["items"]
+        search_results = safe_spotify_call(sp.search, sim_artist, type="artist", limit=1)
+        artist_results = search_results["artists"]["items"] if search_results else []
         if not artist_results:
             continue
         sim_artist_data = artist_results[0]
@@ -310,10 +531,9 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
                 return track
             else:
                 print(f"[VALIDATION] Track '{track['name']}' by '{track['artists'][0]['name']}' failed: {reason}")
+    return None
 
-
-    # Step 4: Spotify similar artists
-    print(f"[INFO] No valid tracks found via Last.fm for '{artist_name}'. Trying Spotify similar artists...")
+def _strategy_spotify_related(artist_name, artist_id, artists_data, existing_artist_ids, seen_playlists):
     similar_artists_data = safe_spotify_call(sp.artist_related_artists, artist_id)
     if not similar_artists_data or "artists" not in similar_artists_data:
         print(f"[WARN] Spotify 404 for artist_related_artists: {artist_id}")
@@ -334,43 +554,227 @@ def select_track_for_artist(artist_name, artists_data, existing_artist_ids):
                 return track
             else:
                 print(f"[VALIDATION] Track '{track['name']}' by '{track['artists'][0]['name']}' failed: {reason}")
+    return None
+
+# name -> (function, prior seconds per attempt). Dict order is the original fixed
+# order and is used when no stats are passed; prior costs are rough guesses.
+DISCOVERY_STRATEGIES = {
+    "scraped_playlists": (_strategy_scraped_playlists, 45.0),
+    "user_playlists": (_strategy_user_playlists, 20.0),
+    "lastfm_similar": (_strategy_lastfm_similar, 10.0),
+    "spotify_related": (_strategy_spotify_related, 8.0),
+}
+
+GLOBAL_STATS_SCOPE = "*"
+STRATEGY_EXPLORATION_RATE = float(os.environ.get("STRATEGY_EXPLORATION_RATE", "0.1"))
+STRATEGY_PRIOR_ATTEMPTS = 4        # pseudo-attempts backing the prior success rate
+STRATEGY_PRIOR_SUCCESS_RATE = 0.5
+STRATEGY_USER_PRIOR_WEIGHT = 10    # user stats need this many attempts to outweigh global
+
+def _ensure_strategy_stats_table():
+    ensure_table(
+        "discovery_strategy_stats",
+        """
+        CREATE TABLE IF NOT EXISTS discovery_strategy_stats (
+            scope TEXT NOT NULL,
+            strategy TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            successes INTEGER NOT NULL DEFAULT 0,
+            total_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, strategy)
+        )
+        """,
+    )
 
+def _empty_strategy_counts():
+    return {name: {"attempts": 0, "successes": 0, "total_seconds": 0.0} for name in DISCOVERY_STRATEGIES}
+
+def load_strategy_stats(spotify_user_id):
+    """
+    Loads per-user and global strategy stats from Postgres.
+    Returns a dict with "user", "global" and "pending" (unflushed deltas) counts.
+    Falls back to empty stats (priors only) if the DB is unavailable.
+    """
+    stats = {
+        "scope": spotify_user_id,
+        "user": _empty_strategy_counts(),
+        "global": _empty_strategy_counts(),
+        "pending": _empty_strategy_counts(),
+    }
+    conn = None
+    try:
+        _ensure_strategy_stats_table()
+        conn = db_connect()
+        conn.autocommit = True
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT scope, strategy, attempts, successes, total_seconds
+            FROM discovery_strategy_stats
+            WHERE scope IN (%s, %s)
+        """, (spotify_user_id, GLOBAL_STATS_SCOPE))
+        for row in cur.fetchall():
+            if row["strategy"] not in DISCOVERY_STRATEGIES:
+                continue
+            bucket = "global" if row["scope"] == GLOBAL_STATS_SCOPE else "user"
+            stats[bucket][row["strategy"]] = {
+                "attempts": row["attempts"],
+                "successes": row["successes"],
+                "total_seconds": row["total_seconds"],
+            }
+        cur.close()
+    except Exception as e:
+        print(f"[WARN] Could not load strategy stats, using priors: {e}")
+    finally:
+        if conn is not None:
+            db_release(conn)
+    return stats
+
+def record_strategy_result(stats, name, success, seconds):
+    """Records one strategy attempt in the user, global and pending counts."""
+    for bucket in ("user", "global", "pending"):
+        counts = stats[bucket][name]
+        counts["attempts"] += 1
+        counts["successes"] += 1 if success else 0
+        counts["total_seconds"] += seconds
+
+def expected_cost_per_track(stats, name):
+    """
+    Expected seconds spent per valid track for a strategy.
+    Global stats are smoothed towards the priors; user stats are smoothed towards global.
+    """
+    prior_seconds = DISCOVERY_STRATEGIES[name][1]
+    g = stats["global"][name]
+    global_rate = (g["successes"] + STRATEGY_PRIOR_SUCCESS_RATE * STRATEGY_PRIOR_ATTEMPTS) / (g["attempts"] + STRATEGY_PRIOR_ATTEMPTS)
+    global_cost = (g["total_seconds"] + prior_seconds * STRATEGY_PRIOR_ATTEMPTS) / (g["attempts"] + STRATEGY_PRIOR_ATTEMPTS)
+
+    u = stats["user"][name]
+    rate = (u["successes"] + global_rate * STRATEGY_USER_PRIOR_WEIGHT) / (u["attempts"] + STRATEGY_USER_PRIOR_WEIGHT)
+    cost = (u["total_seconds"] + global_cost * STRATEGY_USER_PRIOR_WEIGHT) / (u["attempts"] + STRATEGY_USER_PRIOR_WEIGHT)
+    return cost / max(rate, 0.01)
+
+def order_strategies(stats=None):
+    """
+    Returns strategy names cheapest-first by expected cost per valid track.
+    With probability STRATEGY_EXPLORATION_RATE the order is shuffled instead so
+    strategies that look bad still get sampled now and then.
+    """
+    names = list(DISCOVERY_STRATEGIES)
+    if stats is None:
+        return names
+    if random.random() < STRATEGY_EXPLORATION_RATE:
+        random.shuffle(names)
+        return names
+    return sorted(names, key=lambda name: expected_cost_per_track(stats, name))
+
+def flush_strategy_stats(stats):
+    """Adds this run's pending deltas to the user and global rows in Postgres."""
+    rows = []
+    for name, counts in stats["pending"].items():
+        if not counts["attempts"]:
+            continue
+        for scope in (stats["scope"], GLOBAL_STATS_SCOPE):
+            rows.append((scope, name, counts["attempts"], counts["successes"], counts["total_seconds"]))
+    if not rows:
+        return
+    conn = None
+    try:
+        _ensure_strategy_stats_table()
+        conn = db_connect()
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO discovery_strategy_stats (scope, strategy, attempts, successes, total_seconds)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (scope, strategy) DO UPDATE
+            SET attempts = discovery_strategy_stats.attempts + EXCLUDED.attempts,
+                successes = discovery_strategy_stats.successes + EXCLUDED.successes,
+                total_seconds = discovery_strategy_stats.total_seconds + EXCLUDED.total_seconds
+        """, rows)
+        conn.commit()
+        cur.close()
+        stats["pending"] = _empty_strategy_counts()
+    except Exception as e:
+        print(f"[WARN] Failed to save strategy stats: {e}")
+    finally:
+        if conn is not None:
+            db_release(conn)
+
+def select_track_for_artist(artist_name, artists_data, existing_artist_ids, strategy_stats=None):
+    seen_playlists = set()
+
+    search_results = safe_spotify_call(sp.search, artist_name, type="artist", limit=1)
+    artist_results = search_results["artists"]["items"] if search_results else []
+    if not artist_results:
+        print(f"[WARN] No Spotify artist found for '{artist_name}'")
+        return None
+    artist_id = artist_results[0]["id"]
+
+    for name in order_strategies(strategy_stats):
+        strategy = DISCOVERY_STRATEGIES[name][0]
+        print(f"[INFO] Trying strategy '{name}' for '{artist_name}'")
+        started = time.monotonic()
+        track = strategy(
+            artist_name=artist_name,
+            artist_id=artist_id,
+            artists_data=artists_data,
+            existing_artist_ids=existing_artist_ids,
+            seen_playlists=seen_playlists,
+        )
+        if strategy_stats is not None:
+            record_strategy_result(strategy_stats, name, track is not None, time.monotonic() - started)
+        if track:
+            return track
+        print(f"[INFO] Strategy '{name}' found no valid track for '{artist_name}'")
 
     return None
 
 # ==== LAST.FM TRACKS ====
-def fetch_all_recent_tracks(username=LASTFM_USERNAME, api_key=LASTFM_API_KEY):
-    recent_tracks = []
+def iter_recent_scrobble_pages(username=LASTFM_USERNAME, api_key=LASTFM_API_KEY, since_ts=None):
+    """
+    Yields one list of (artist_lower, unix_ts) per Last.fm page, newest first.
+    since_ts is sent as Last.fm's `from` filter and re-checked locally, so
+    only scrobbles inside the window are read. Artist keys are interned.
+    Nothing outside the current page is held in memory.
+    """
     page = 1
     while True:
         params = {"method": "user.getrecenttracks", "user": username, "api_key": api_key, "format": "json", "limit": 200, "page": page}
+        if since_ts is not None:
+            params["from"] = since_ts
         time.sleep(0.25)
-        resp = requests.get("http://ws.audioscrobbler.com/2.0/", params=params)
+        resp = get_http_session("lastfm").get("http://ws.audioscrobbler.com/2.0/", params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         tracks = data.get("recenttracks", {}).get("track", [])
         if not tracks:
             break
+        scrobbles = []
         for t in tracks:
             if "@attr" in t and t["@attr"].get("nowplaying") == "true":
                 continue
             if "date" in t and "uts" in t["date"]:
                 ts = int(t["date"]["uts"])
-                recent_tracks.append({"artist": t["artist"]["#text"].lower(), "track": t["name"], "played_at": datetime.fromtimestamp(ts, tz=timezone.utc)})
+                if since_ts is not None and ts < since_ts:
+                    continue
+                scrobbles.append((sys.intern(t["artist"]["#text"].lower()), ts))
+        yield scrobbles
         total_pages = int(data.get("recenttracks", {}).get("@attr", {}).get("totalPages", 1))
         if page >= total_pages:
             break
         page += 1
-    return recent_tracks
 
-def build_artist_play_map(recent_tracks, days_limit=365):
-    cutoff = datetime.now(timezone.utc) - timedelta(days=days_limit)
+def build_artist_play_map(days_limit=365, username=LASTFM_USERNAME, api_key=LASTFM_API_KEY):
+    """
+    Streams the user's scrobbles from the last days_limit days into
+    {artist_lower: array("q") of unix timestamps}.
+    """
+    cutoff = int((datetime.now(timezone.utc) - timedelta(days=days_limit)).timestamp())
     artist_play_map = {}
-    for t in recent_tracks:
-        if t["played_at"] < cutoff:
-            continue
-        artist = t["artist"]
-        artist_play_map.setdefault(artist, []).append(t["played_at"])
+    for scrobbles in iter_recent_scrobble_pages(username, api_key, since_ts=cutoff):
+        for artist, ts in scrobbles:
+            plays = artist_play_map.get(artist)
+            if plays is None:
+                plays = artist_play_map[artist] = array("q")
+            plays.append(ts)
     return artist_play_map
 
 def validate_track(track, artists_data, existing_artist_ids=None, max_followers=None):
@@ -398,103 +802,301 @@ def validate_track(track, artists_data, existing_artist_ids=None, max_followers=
     if existing_artist_ids and (aid in existing_artist_ids or name_lower in existing_artist_ids):
         return False, f"Artist '{artist['name']}' already has a track in playlist"
 
-    # 3. Max followers
+    # 3. Max followers (negative cache first, so known-big artists cost no API call)
     if max_followers:
+        followers = cached_follower_count(aid)
+        if followers is not None and followers > max_followers:
+            return False, f"Artist '{artist['name']}' has {followers} followers (cached), exceeds max {max_followers}"
+
         full_artist = safe_spotify_call(sp.artist, aid)
         time.sleep(.1)
         if full_artist and full_artist["followers"]["total"] > max_followers:
-            return False, f"Artist '{artist['name']}' has {full_artist['followers']['total']} followers, exceeds max {max_followers}"
+            followers = full_artist["followers"]["total"]
+            negative_cache_put("artist", aid, "over_followers", followers)
+            return False, f"Artist '{artist['name']}' has {followers} followers, exceeds max {max_followers}"
 
     return True, ""
 
 
 # ==== UPDATE ARTISTS CACHE (SAFE VERSION) ====
-def update_artists_from_likes_db(spotify_user_id, sp_conn):
+FULL_RECONCILE_DAYS = int(os.environ.get("FULL_RECONCILE_DAYS", "30"))
+LIKES_DB_BATCH_SIZE = 500
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
+BACKFILL_REQUESTS_PER_SECOND = float(os.environ.get("BACKFILL_REQUESTS_PER_SECOND", "8"))
+BACKFILL_PAGE_RETRIES = 3
+BACKFILL_COMMIT_PAGES = 20
+
+def _ensure_likes_sync_schema():
+    ensure_table(
+        "likes_sync",
+        """
+        ALTER TABLE spotify_users
+            ADD COLUMN IF NOT EXISTS last_synced_added_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS last_full_reconcile_at TIMESTAMPTZ
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_artists_staging (
+            spotify_user_id TEXT NOT NULL,
+            artist_id TEXT NOT NULL,
+            artist_name TEXT NOT NULL,
+            total_liked INTEGER NOT NULL,
+            PRIMARY KEY (spotify_user_id, artist_id)
+        )
+        """,
+    )
+
+def _parse_added_at(value):
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+def _count_like_artists(items, counts, names):
+    """Adds one like per artist on each saved-track item to counts/names."""
+    for item in items:
+        track = item.get("track")
+        if not track:
+            continue
+        for artist in track.get("artists") or []:
+            aid = artist.get("id")
+            if not aid:
+                continue
+            counts[aid] = counts.get(aid, 0) + 1
+            names[aid] = artist["name"]
+
+def _write_like_counts(cur, spotify_user_id, counts, names, table="user_artists"):
+    """Adds per-artist like counts to the stored totals in `table`, in batches."""
+    sql = f"""
+        INSERT INTO {table} (spotify_user_id, artist_id, artist_name, total_liked)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (spotify_user_id, artist_id) DO UPDATE
+        SET total_liked = {table}.total_liked + EXCLUDED.total_liked,
+            artist_name = EXCLUDED.artist_name
     """
-    Updates the user's liked artists in the user_artists table.
-    - New user: scan all liked tracks
-    - Existing user: scan only latest 200 tracks
-    Returns a dictionary of all artists for this user.
+    rows = [(spotify_user_id, aid, names[aid], count) for aid, count in counts.items()]
+    for i in range(0, len(rows), LIKES_DB_BATCH_SIZE):
+        cur.executemany(sql, rows[i:i + LIKES_DB_BATCH_SIZE])
+
+def load_user_artists(cur, spotify_user_id):
+    """Returns {artist_id: {"name", "total_liked"}} for the user from user_artists."""
+    cur.execute("""
+        SELECT artist_id, artist_name, total_liked
+        FROM user_artists
+        WHERE spotify_user_id = %s
+    """, (spotify_user_id,))
+    return {row["artist_id"]: {"name": row["artist_name"], "total_liked": row["total_liked"]} for row in cur.fetchall()}
+
+def _scan_likes_incremental(sp_conn, watermark):
     """
-    print(f"[INFO] Updating liked artists for Spotify user {spotify_user_id}")
+    Walks saved tracks newest-first and stops at the first like at or before
+    the watermark. Returns (counts, names, tracks processed, newest added_at),
+    or None if a page fails.
+    """
+    counts, names = {}, {}
+    newest = watermark
+    offset = 0
+    batch_size = 50
+    total_processed = 0
+    reached_watermark = False
 
-    # Connect to DB
-    conn = psycopg2.connect(os.environ["DATABASE_URL"])
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    while not reached_watermark:
+        results = safe_spotify_call(sp_conn.current_user_saved_tracks, limit=batch_size, offset=offset)
+        if not results or "items" not in results:
+            # A gap here would leave likes behind the new watermark uncounted
+            print(f"[WARN] Saved tracks page at offset {offset} failed; keeping watermark, nothing written")
+            return None
 
-    # Enable autocommit mode to prevent transaction abort blocking
-    conn.autocommit = True
+        new_items = []
+        for item in results["items"]:
+            added_at = _parse_added_at(item["added_at"])
+            if added_at <= watermark:
+                reached_watermark = True
+                break
+            new_items.append(item)
+            newest = max(newest, added_at)
+        _count_like_artists(new_items, counts, names)
+        total_processed += len(new_items)
 
-    # Check if user exists
-    cur.execute("SELECT 1 FROM spotify_users WHERE spotify_user_id = %s", (spotify_user_id,))
-    user_exists = cur.fetchone() is not None
+        offset += batch_size
+        if len(results["items"]) < batch_size:
+            break
 
-    # Scan limit: all tracks for new user, 200 latest for existing user
-    limit = 200 if user_exists else None
-    offset = 0
-    batch_size = 50
+    return counts, names, total_processed, newest
+
+def _iter_saved_track_pages(sp_conn, batch_size=50):
+    """
+    Yields every saved-tracks page. The first page's total gives all remaining
+    offsets, which are fetched concurrently by BACKFILL_WORKERS threads paced to
+    BACKFILL_REQUESTS_PER_SECOND. Pages arrive out of order and at most
+    2 * BACKFILL_WORKERS are held at once. A page that still fails after
+    retries is yielded as None.
+    """
+    first = safe_spotify_call(sp_conn.current_user_saved_tracks, limit=batch_size, offset=0)
+    yield first
+    if not first or "items" not in first:
+        return
+
+    offsets = iter(range(batch_size, first.get("total", 0), batch_size))
+    wait_for_slot = make_rate_limiter(BACKFILL_REQUESTS_PER_SECOND)
+
+    def fetch(offset):
+        for _ in range(BACKFILL_PAGE_RETRIES):
+            wait_for_slot()
+            page = _spotify_call(sp_conn.current_user_saved_tracks, limit=batch_size, offset=offset)
+            if page and "items" in page:
+                return page
+        return None
+
+    with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        pending = {pool.submit(fetch, offset) for offset in islice(offsets, BACKFILL_WORKERS * 2)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    next_offset = next(offsets, None)
+                    if next_offset is not None:
+                        pending.add(pool.submit(fetch, next_offset))
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def _stage_like_counts(spotify_user_id, counts, names, clear=False):
+    """Adds counts to the user's rows in user_artists_staging and commits."""
+    conn = db_connect()
+    try:
+        cur = conn.cursor()
+        if clear:
+            cur.execute("DELETE FROM user_artists_staging WHERE spotify_user_id = %s", (spotify_user_id,))
+        _write_like_counts(cur, spotify_user_id, counts, names, table="user_artists_staging")
+        conn.commit()
+        cur.close()
+    finally:
+        db_release(conn)
+
+def _scan_likes_full(sp_conn, spotify_user_id):
+    """
+    Recounts every saved track into user_artists_staging, fetching pages
+    concurrently and committing every BACKFILL_COMMIT_PAGES pages, so memory
+    stays bounded and no DB connection is held while waiting on Spotify.
+    user_artists itself is untouched; the caller swaps the staged counts in.
+    Returns (tracks processed, newest added_at), or None if the scan is incomplete.
+    """
+    counts, names = {}, {}
+    newest = None
     total_processed = 0
-    artists_dict = {}
+    pages_since_commit = 0
+    expected_total = None
 
-    while True:
-        current_limit = batch_size
-        if limit:
-            remaining = limit - total_processed
-            if remaining <= 0:
-                break
-            current_limit = min(batch_size, remaining)
+    _stage_like_counts(spotify_user_id, {}, {}, clear=True)
 
-        results = safe_spotify_call(sp_conn.current_user_saved_tracks, limit=current_limit, offset=offset)
+    for results in _iter_saved_track_pages(sp_conn):
         if not results or "items" not in results:
-            break
+            print("[WARN] Saved tracks page failed; abandoning full scan")
+            return None
+        if expected_total is None:
+            expected_total = results.get("total", 0)
 
         for item in results["items"]:
-            track = item["track"]
-            added_at = datetime.strptime(item["added_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-
-            for artist in track["artists"]:
-                aid = artist["id"]
-                name = artist["name"]
-
-                # Insert or update artist for this user safely
-                try:
-                    cur.execute("""
-                        INSERT INTO user_artists (spotify_user_id, artist_id, artist_name, total_liked)
-                        VALUES (%s, %s, %s, 1)
-                        ON CONFLICT (spotify_user_id, artist_id) DO UPDATE
-                        SET total_liked = user_artists.total_liked + 1,
-                            artist_name = EXCLUDED.artist_name
-                    """, (spotify_user_id, aid, name))
-                except Exception as e:
-                    # Rollback just this failed statement and continue
-                    print(f"[WARN] Failed to update artist '{name}' in DB: {e}")
-                    conn.rollback()
-                    continue
+            added_at = _parse_added_at(item["added_at"])
+            newest = added_at if newest is None else max(newest, added_at)
+        _count_like_artists(results["items"], counts, names)
+        total_processed += len(results["items"])
+
+        pages_since_commit += 1
+        if pages_since_commit >= BACKFILL_COMMIT_PAGES:
+            _stage_like_counts(spotify_user_id, counts, names)
+            counts, names = {}, {}
+            pages_since_commit = 0
+            print(f"[INFO] Full scan progress: {total_processed}/{expected_total} tracks")
+
+    if total_processed != expected_total:
+        # Pages were lost or the library changed mid-scan; counts can't be trusted
+        print(f"[WARN] Full scan read {total_processed} of {expected_total} saved tracks; abandoning")
+        return None
 
-                # Build in-memory dict
-                if aid not in artists_dict:
-                    artists_dict[aid] = {"name": name, "total_liked": 1}
-                else:
-                    artists_dict[aid]["total_liked"] += 1
+    _stage_like_counts(spotify_user_id, counts, names)
+    print(f"[INFO] Full scan progress: {total_processed}/{expected_total} tracks")
+    return total_processed, newest
 
-            total_processed += 1
+def update_artists_from_likes_db(spotify_user_id, sp_conn, mode=None):
+    """
+    Updates the user's liked artists in the user_artists table.
+    - Incremental (default for synced users): only likes newer than the user's
+      last_synced_added_at watermark are counted
+    - Full: recount the whole library into a staging table and swap it in; used for
+      new users, when the last reconcile is older than FULL_RECONCILE_DAYS, or when mode="full"
+    A failed scan leaves user_artists and the watermark as they were.
+    Returns a dictionary of all artists for this user.
+    """
+    print(f"[INFO] Updating liked artists for Spotify user {spotify_user_id}")
 
-        offset += batch_size
+    _ensure_likes_sync_schema()
+    conn = db_connect()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""
+            SELECT last_synced_added_at, last_full_reconcile_at
+            FROM spotify_users WHERE spotify_user_id = %s
+        """, (spotify_user_id,))
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        db_release(conn)
+    watermark = row["last_synced_added_at"] if row else None
+    last_reconcile = row["last_full_reconcile_at"] if row else None
+
+    if mode is None:
+        reconcile_due = last_reconcile is None or datetime.now(timezone.utc) - last_reconcile > timedelta(days=FULL_RECONCILE_DAYS)
+        mode = "full" if watermark is None or reconcile_due else "incremental"
+    elif mode == "incremental" and watermark is None:
+        mode = "full"
+    print(f"[INFO] Liked-tracks sync mode: {mode} (watermark {watermark})")
+
+    # Spotify I/O happens with no DB connection checked out
+    if mode == "full":
+        result = _scan_likes_full(sp_conn, spotify_user_id)
+    else:
+        result = _scan_likes_incremental(sp_conn, watermark)
 
-        # Break if fewer items than batch were returned
-        if len(results["items"]) < batch_size:
-            break
+    total_processed = 0
+    conn = db_connect()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if result is None:
+            print("[WARN] Liked-tracks sync failed; using previously stored counts")
+        else:
+            # Counts and watermark are written together so a failed run can't double count
+            if mode == "full":
+                total_processed, newest = result
+                cur.execute("DELETE FROM user_artists WHERE spotify_user_id = %s", (spotify_user_id,))
+                cur.execute("""
+                    INSERT INTO user_artists (spotify_user_id, artist_id, artist_name, total_liked)
+                    SELECT spotify_user_id, artist_id, artist_name, total_liked
+                    FROM user_artists_staging WHERE spotify_user_id = %s
+                """, (spotify_user_id,))
+                cur.execute("DELETE FROM user_artists_staging WHERE spotify_user_id = %s", (spotify_user_id,))
+            else:
+                counts, names, total_processed, newest = result
+                _write_like_counts(cur, spotify_user_id, counts, names)
+            cur.execute("""
+                UPDATE spotify_users
+                SET last_synced_added_at = COALESCE(%s, last_synced_added_at),
+                    last_full_reconcile_at = CASE WHEN %s THEN NOW() ELSE last_full_reconcile_at END
+                WHERE spotify_user_id = %s
+            """, (newest, mode == "full", spotify_user_id))
+            conn.commit()
+
+        artists_dict = load_user_artists(cur, spotify_user_id)
+        cur.close()
+    finally:
+        db_release(conn)
 
-    cur.close()
-    conn.close()
     print(f"[INFO] Finished updating liked artists for user {spotify_user_id}: {total_processed} tracks processed")
     return artists_dict
 
 # ==== CALCULATE LOTTERY WEIGHTS ====
 def calculate_weights(all_artists, artist_play_map):
     now = datetime.now(timezone.utc)
-    recent_14_cutoff = now - timedelta(days=14)
-    recent_60_cutoff = now - timedelta(days=60)
+    recent_14_cutoff = int((now - timedelta(days=14)).timestamp())
+    recent_60_cutoff = int((now - timedelta(days=60)).timestamp())
     stats = {}
     max_recent_14 = 0
     max_recent_60 = 0
@@ -524,19 +1126,40 @@ def calculate_weights(all_artists, artist_play_map):
 
     return weights
 
+def get_all_playlist_items(playlist_id, item_fields):
+    """
+    Pages through the whole playlist (100 items per call) and returns every item
+    with a track ID, or None if any page fails.
+    """
+    items = []
+    offset = 0
+    while True:
+        page = safe_spotify_call(
+            sp.playlist_items,
+            playlist_id,
+            fields=f"items({item_fields}),next",
+            limit=100,
+            offset=offset
+        )
+        if not page or "items" not in page:
+            print(f"[WARN] Failed reading playlist {playlist_id} at offset {offset}")
+            return None
+        items.extend(item for item in page["items"] if item.get("track") and item["track"].get("id"))
+        if not page.get("next"):
+            return items
+        offset += 100
+
 def remove_old_tracks_from_playlist(playlist_id, days_old=8):
     print(f"[INFO] Checking for tracks older than {days_old} days in playlist {playlist_id}...")
-    existing_tracks = safe_spotify_call(
-        sp.playlist_items,
-        playlist_id,
-        fields="items(track(id,name,artists(id,name)), added_at)",
-        limit=100  # adjust if your playlist is bigger
-    )
+    existing_tracks = get_all_playlist_items(playlist_id, "track(id,name,artists(id,name)),added_at")
+    if existing_tracks is None:
+        print("[WARN] Could not read playlist; skipping old track cleanup")
+        return 0
 
     now = datetime.now(timezone.utc)
     tracks_to_remove = []
 
-    for item in existing_tracks["items"]:
+    for item in existing_tracks:
         track = item["track"]
         added_at = datetime.strptime(item["added_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
         age_days = (now - added_at).days
@@ -545,7 +1168,9 @@ def remove_old_tracks_from_playlist(playlist_id, days_old=8):
 
     removed_count = 0
     if tracks_to_remove:
-        sp.playlist_remove_all_occurrences_of_items(playlist_id, [t["uri"] for t in tracks_to_remove])
+        uris = [t["uri"] for t in tracks_to_remove]
+        for i in range(0, len(uris), 100):
+            sp.playlist_remove_all_occurrences_of_items(playlist_id, uris[i:i + 100])
         removed_count = len(tracks_to_remove)
         print(f"[INFO] Removed {removed_count} track(s) older than {days_old} days")
     else:
@@ -553,9 +1178,10 @@ def remove_old_tracks_from_playlist(playlist_id, days_old=8):
 
     return removed_count
 
-def send_playlist_update_sms(songs_added, max_songs, removed_count, playlist_id):
+def queue_playlist_update_sms(spotify_user_id, phone, songs_added, max_songs, removed_count, playlist_id):
     """
-    Sends a summary SMS via the Textbelt API.
+    Queues a summary SMS in the notification outbox; the dispatcher in
+    notifications.py sends it.
     """
     today = datetime.now(timezone.utc).strftime("%m/%d/%Y")
     playlist_link = f"https://open.spotify.com/playlist/{playlist_id}"
@@ -576,35 +1202,168 @@ def send_playlist_update_sms(songs_added, max_songs, removed_count, playlist_id)
         #f"Playlist Link: {playlist_link}"
     )
 
-    api_key = os.environ.get("TEXTBELT_API_KEY")
-    phone = os.environ.get("MY_PHONE_NUMBER")
-
-    if not api_key or not phone:
-        print("⚠️ Missing TEXTBELT_API_KEY or MY_PHONE_NUMBER in environment")
+    if not phone:
+        print(f"⚠️ No phone number for {spotify_user_id}, not queueing SMS")
         return
 
     try:
-        resp = requests.post(
-            "https://textbelt.com/text",
-            data={
-                "phone": phone,
-                "message": message_body,
-                "key": api_key,
-            },
-            timeout=10
+        enqueue_notification(spotify_user_id, phone, message_body)
+    except Exception as e:
+        print(f"⚠️ Failed to queue SMS for {spotify_user_id}: {e}")
+
+
+
+# ==== RUN CHECKPOINTS ====
+# Progress of each run is saved to recommendation_runs so a run that dies part way
+# (worker crash, redeploy) is picked up by the next run for the same user/playlist
+# instead of redoing the scrape and validation work.
+# A run holds a lease on its row (owner + heartbeat_at, renewed by every checkpoint)
+# so only one worker drives a playlist at a time; a run is only resumed once its
+# heartbeat is older than RUN_LEASE_SECONDS.
+
+RUN_RESUME_HOURS = int(os.environ.get("RUN_RESUME_HOURS", "12"))
+RUN_LEASE_SECONDS = int(os.environ.get("RUN_LEASE_SECONDS", "600"))
+
+def _ensure_run_checkpoint_table():
+    ensure_table(
+        "recommendation_runs",
+        """
+        CREATE TABLE IF NOT EXISTS recommendation_runs (
+            run_id BIGSERIAL PRIMARY KEY,
+            spotify_user_id TEXT NOT NULL,
+            playlist_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            seed BIGINT NOT NULL,
+            lottery_order JSONB NOT NULL,
+            tried_artist_ids JSONB NOT NULL DEFAULT '[]',
+            added_track_ids JSONB NOT NULL DEFAULT '[]',
+            added_artist_ids JSONB NOT NULL DEFAULT '[]',
+            pending_track_id TEXT,
+            cleanup_done BOOLEAN NOT NULL DEFAULT FALSE,
+            removed_count INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
         )
-        data = resp.json()
-        if data.get("success"):
-            print("📱 SMS notification sent successfully via Textbelt!")
+        """,
+        """
+        ALTER TABLE recommendation_runs
+            ADD COLUMN IF NOT EXISTS added_artist_ids JSONB NOT NULL DEFAULT '[]',
+            ADD COLUMN IF NOT EXISTS owner TEXT,
+            ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS recommendation_runs_open_idx
+        ON recommendation_runs (spotify_user_id, playlist_id) WHERE status <> 'done'
+        """,
+    )
+
+def build_lottery_order(weights, seed):
+    """
+    Weighted order without replacement (Efraimidis-Spirakis keys), reproducible
+    from the seed. Zero-weight artists are left out.
+    """
+    rng = random.Random(seed)
+    keyed = [(rng.random() ** (1.0 / w), aid) for aid, w in weights.items() if w > 0]
+    keyed.sort(reverse=True)
+    return [aid for _, aid in keyed]
+
+def start_or_resume_run(spotify_user_id, playlist_id, weights):
+    """
+    Claims the run for this user/playlist and returns its checkpoint dict: an
+    unfinished run updated within RUN_RESUME_HOURS whose lease has lapsed, or a
+    new one with a fresh seed and lottery order. Older unfinished runs are marked
+    abandoned. Returns None if another worker holds a live lease on the playlist.
+    """
+    _ensure_run_checkpoint_table()
+    owner = uuid.uuid4().hex
+    conn = db_connect()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # Serializes claimers for this playlist until commit, so two runs can't both
+        # see "nothing open" and insert, or both take over the same stale run.
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{spotify_user_id}:{playlist_id}",))
+        cur.execute("""
+            UPDATE recommendation_runs SET status = 'abandoned', updated_at = NOW()
+            WHERE spotify_user_id = %s AND playlist_id = %s AND status NOT IN ('done', 'abandoned')
+              AND updated_at < NOW() - make_interval(hours => %s)
+        """, (spotify_user_id, playlist_id, RUN_RESUME_HOURS))
+        cur.execute("""
+            SELECT run_id, heartbeat_at >= NOW() - make_interval(secs => %s) AS live
+            FROM recommendation_runs
+            WHERE spotify_user_id = %s AND playlist_id = %s AND status NOT IN ('done', 'abandoned')
+            ORDER BY updated_at DESC LIMIT 1
+        """, (RUN_LEASE_SECONDS, spotify_user_id, playlist_id))
+        row = cur.fetchone()
+        if row and row["live"]:
+            conn.commit()
+            print(f"[INFO] Run {row['run_id']} for playlist {playlist_id} is still in progress elsewhere")
+            return None
+        if row:
+            cur.execute("""
+                UPDATE recommendation_runs SET owner = %s, heartbeat_at = NOW(), updated_at = NOW()
+                WHERE run_id = %s
+                RETURNING *
+            """, (owner, row["run_id"]))
+            checkpoint = dict(cur.fetchone())
+            checkpoint["resumed"] = True
+            print(f"[INFO] Resuming run {checkpoint['run_id']}: {len(checkpoint['added_track_ids'])} tracks added, "
+                  f"{len(checkpoint['tried_artist_ids'])} artists tried")
         else:
-            print(f"⚠️ Textbelt failed: {data}")
+            seed = random.randrange(2 ** 62)
+            order = build_lottery_order(weights, seed)
+            cur.execute("""
+                INSERT INTO recommendation_runs (spotify_user_id, playlist_id, seed, lottery_order, owner)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING *
+            """, (spotify_user_id, playlist_id, seed, Json(order), owner))
+            checkpoint = dict(cur.fetchone())
+            checkpoint["resumed"] = False
+            print(f"[INFO] Started run {checkpoint['run_id']} with seed {seed}")
+        conn.commit()
+        cur.close()
+    finally:
+        db_release(conn)
+    checkpoint["lease_lost"] = False
+    return checkpoint
+
+def save_run_checkpoint(checkpoint, **fields):
+    """
+    Updates the given columns on the run row (and the in-memory checkpoint) and
+    renews the lease. Failures are logged, not raised: losing a checkpoint only
+    costs redone work. If another worker has taken the run over, nothing is
+    written and checkpoint["lease_lost"] is set.
+    """
+    checkpoint.update(fields)
+    columns = ", ".join(f"{name} = %s" for name in fields)
+    values = [Json(v) if isinstance(v, (list, dict)) else v for v in fields.values()]
+    conn = None
+    try:
+        conn = db_connect()
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE recommendation_runs SET {columns}, heartbeat_at = NOW(), updated_at = NOW() "
+            "WHERE run_id = %s AND owner = %s",
+            (*values, checkpoint["run_id"], checkpoint["owner"])
+        )
+        if cur.rowcount == 0:
+            checkpoint["lease_lost"] = True
+            print(f"[WARN] Run {checkpoint['run_id']} was taken over by another worker")
+        cur.close()
     except Exception as e:
-        print(f"⚠️ Exception while sending SMS via Textbelt: {e}")
+        print(f"[WARN] Failed to save checkpoint for run {checkpoint['run_id']}: {e}")
+    finally:
+        if conn is not None:
+            db_release(conn)
 
+def _check_run_lease(checkpoint):
+    """Stops a run whose lease was taken over, before it touches the playlist again."""
+    if checkpoint["lease_lost"]:
+        raise RuntimeError(f"Lost the lease on run {checkpoint['run_id']}")
 
 
 # ==== MAIN COMBINED SCRIPT ====
-def run_recommendation_script(access_token, refresh_token, phone_number, playlist_id, spotify_user_id, display_name):
+def run_recommendation_script(refresh_token, phone_number, playlist_id, spotify_user_id, display_name):
     ...
 
     """
@@ -615,24 +1374,21 @@ def run_recommendation_script(access_token, refresh_token, phone_number, playlis
     print("Starting Enhanced Recs Script...")
     time.sleep(1)
 
-    # Override environment variables for this user
-    os.environ["SPOTIFY_REFRESH_TOKEN"] = refresh_token
-    os.environ["MY_PHONE_NUMBER"] = phone_number
-
     # ==== SPOTIFY AUTH ====
-    auth_manager = SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIFY_REDIRECT_URI,
-        scope=scope,
-        cache_path=None
-    )
-    token_info = auth_manager.refresh_access_token(refresh_token)
-    access_token = token_info["access_token"]
-    sp = Spotify(auth=access_token)
+    # Reuses the stored access token (shared with the web tier) until it's about to
+    # expire; refresh_token is only needed if the store has nothing for this user.
+    sp = get_spotify_client(spotify_user_id, refresh_token)
 
 
+    playlist_id = playlist_id or OUTPUT_PLAYLIST_ID
+
     # Update artist data and generate playlist
+    songs_added = 0
+    max_songs = 50
+    strategy_stats = None
+    checkpoint = None
+    running_elsewhere = False
+    removed_count = 0
     try:
         user_profile = sp.current_user()
         spotify_user_id = user_profile["id"]
@@ -640,45 +1396,91 @@ def run_recommendation_script(access_token, refresh_token, phone_number, playlis
         artists_data = update_artists_from_likes_db(spotify_user_id, sp)
         all_artists = artists_data
 
-        recent_tracks = fetch_all_recent_tracks()
-        artist_play_map = build_artist_play_map(recent_tracks)
+        artist_play_map = build_artist_play_map()
         weights = calculate_weights(all_artists, artist_play_map)
 
-        songs_added = 0
-        max_songs = 50
-        rolled_aids = set()
-
-        existing_tracks = safe_spotify_call(
-            sp.playlist_items,
-            OUTPUT_PLAYLIST_ID,
-            fields="items(track(id, artists(id,name)))",
-            limit=100
-        )
-        existing_artist_ids = {t["track"]["artists"][0]["id"] for t in existing_tracks["items"]}
+        strategy_stats = load_strategy_stats(spotify_user_id)
+        checkpoint = start_or_resume_run(spotify_user_id, playlist_id, weights)
+        if checkpoint is None:
+            # Another worker is filling this playlist; it'll clean up and send the summary
+            running_elsewhere = True
+            return
+        tried = list(checkpoint["tried_artist_ids"])
+        added_track_ids = list(checkpoint["added_track_ids"])
+        added_artist_ids = list(checkpoint["added_artist_ids"])
+
+        existing_tracks = get_all_playlist_items(playlist_id, "track(id,artists(id,name))")
+        if existing_tracks is None:
+            # Without the full playlist we can't rule out duplicates; leave the run open to resume
+            raise RuntimeError(f"Could not read playlist {playlist_id}")
+        track_artists = {t["track"]["id"]: t["track"]["artists"][0]["id"] for t in existing_tracks if t["track"].get("artists")}
+        existing_track_ids = set(track_artists) | set(added_track_ids)
+        existing_artist_ids = set(track_artists.values()) | set(added_artist_ids)
         print(f"[INFO] Found {len(existing_artist_ids)} existing artists in playlist")
 
-        while songs_added < max_songs and len(rolled_aids) < len(weights):
-            artist_ids = list(weights.keys())
-            weight_values = [weights[aid] for aid in artist_ids]
-            chosen_aid = choices(artist_ids, weights=weight_values, k=1)[0]
-            if chosen_aid in rolled_aids:
+        # A track written as pending but not confirmed either made it into the playlist
+        # before the crash or didn't; the playlist itself is the source of truth.
+        pending = checkpoint["pending_track_id"]
+        if pending:
+            if pending in track_artists and pending not in added_track_ids:
+                added_track_ids.append(pending)
+                added_artist_ids.append(track_artists[pending])
+            save_run_checkpoint(checkpoint, pending_track_id=None, added_track_ids=added_track_ids, added_artist_ids=added_artist_ids)
+            _check_run_lease(checkpoint)
+        songs_added = len(added_track_ids)
+
+        tried_set = set(tried)
+        for chosen_aid in checkpoint["lottery_order"]:
+            if songs_added >= max_songs:
+                break
+            if chosen_aid in tried_set or chosen_aid not in all_artists:
                 continue
-            rolled_aids.add(chosen_aid)
+
+            # Marked before the attempt so an artist that crashes the worker isn't retried forever
+            tried.append(chosen_aid)
+            tried_set.add(chosen_aid)
+            save_run_checkpoint(checkpoint, tried_artist_ids=tried)
+            _check_run_lease(checkpoint)
+
             artist_name = all_artists[chosen_aid]["name"]
-            print(f"[INFO] Lottery picked artist '{artist_name}' (weight {weights[chosen_aid]:.2f})")
+            print(f"[INFO] Lottery picked artist '{artist_name}' (weight {weights.get(chosen_aid, 0):.2f})")
 
-            track = select_track_for_artist(artist_name, artists_data, existing_artist_ids)
+            track = select_track_for_artist(artist_name, artists_data, existing_artist_ids, strategy_stats)
             if not track:
                 print(f"[INFO] No valid track found for '{artist_name}', rerolling")
                 continue
+            if track["id"] in existing_track_ids:
+                print(f"[INFO] Track '{track['name']}' is already in the playlist, rerolling")
+                continue
 
-            sp.playlist_add_items(OUTPUT_PLAYLIST_ID, [track["id"]])
+            save_run_checkpoint(checkpoint, pending_track_id=track["id"])
+            _check_run_lease(checkpoint)
+            sp.playlist_add_items(playlist_id, [track["id"]])
             time.sleep(.1)
             existing_artist_ids.add(track["artists"][0]["id"])
+            existing_track_ids.add(track["id"])
+            added_track_ids.append(track["id"])
+            added_artist_ids.append(track["artists"][0]["id"])
+            save_run_checkpoint(checkpoint, pending_track_id=None, added_track_ids=added_track_ids, added_artist_ids=added_artist_ids)
             songs_added += 1
             print(f"[INFO] Added track '{track['name']}' by '{track['artists'][0]['name']}'")
 
+        if checkpoint:
+            save_run_checkpoint(checkpoint, status="cleanup")
+
     finally:
-        close_global_driver()
-        removed_count = remove_old_tracks_from_playlist(OUTPUT_PLAYLIST_ID, days_old=8)
-        send_playlist_update_sms(songs_added, max_songs, removed_count, OUTPUT_PLAYLIST_ID)
+        release_global_driver()
+        if strategy_stats is not None:
+            flush_strategy_stats(strategy_stats)
+        # Cleanup and the summary belong to whichever worker holds the run's lease
+        if not running_elsewhere and not (checkpoint and checkpoint["lease_lost"]):
+            if checkpoint and checkpoint["cleanup_done"]:
+                removed_count = checkpoint["removed_count"]
+            else:
+                removed_count = remove_old_tracks_from_playlist(playlist_id, days_old=8)
+                if checkpoint:
+                    save_run_checkpoint(checkpoint, cleanup_done=True, removed_count=removed_count)
+            queue_playlist_update_sms(spotify_user_id, phone_number, songs_added, max_songs, removed_count, playlist_id)
+            # Runs that raised stay open so the next run resumes them
+            if checkpoint and checkpoint["status"] == "cleanup":
+                save_run_checkpoint(checkpoint, status="done")
@@ -0,0 +1,177 @@
+import os
+import time
+from clients import get_http_session
+from db import db_connect, db_release, ensure_table
+
+# Runs enqueue their summary here instead of texting inline; a dispatcher (in the
+# web process by default, or `python notifications.py` with NOTIFY_DISPATCHER=0
+# on the web tier) sends them.
+# Only the newest pending message per user is sent, the rest are marked coalesced.
+# Claims use SKIP LOCKED so several dispatchers can run at once.
+
+TEXTBELT_ENDPOINT = "https://textbelt.com/text"
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "20"))
+NOTIFY_SENDS_PER_SECOND = float(os.environ.get("NOTIFY_SENDS_PER_SECOND", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_POLL_SECONDS = int(os.environ.get("NOTIFY_POLL_SECONDS", "15"))
+NOTIFY_STALE_SENDING_MINUTES = 10
+
+def _ensure_outbox_table():
+    ensure_table(
+        "notification_outbox",
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            spotify_user_id TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            claimed_at TIMESTAMPTZ,
+            sent_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+        ON notification_outbox (next_attempt_at) WHERE status = 'pending'
+        """,
+    )
+
+def enqueue_notification(spotify_user_id, phone, message):
+    """Adds a message to the outbox. Returns the row id."""
+    _ensure_outbox_table()
+    conn = db_connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO notification_outbox (spotify_user_id, phone, message)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        """, (spotify_user_id, phone, message))
+        outbox_id = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+    finally:
+        db_release(conn)
+    print(f"[INFO] Queued notification {outbox_id} for {spotify_user_id}")
+    return outbox_id
+
+def _claim_batch(conn, batch_size):
+    cur = conn.cursor()
+    # Dispatchers that died mid-send leave rows in 'sending'; hand them back
+    cur.execute("""
+        UPDATE notification_outbox SET status = 'pending'
+        WHERE status = 'sending' AND claimed_at < NOW() - make_interval(mins => %s)
+    """, (NOTIFY_STALE_SENDING_MINUTES,))
+    cur.execute("""
+        UPDATE notification_outbox o SET status = 'coalesced'
+        WHERE o.status = 'pending' AND EXISTS (
+            SELECT 1 FROM notification_outbox n
+            WHERE n.spotify_user_id = o.spotify_user_id AND n.status = 'pending' AND n.id > o.id
+        )
+    """)
+    cur.execute("""
+        UPDATE notification_outbox
+        SET status = 'sending', claimed_at = NOW(), attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM notification_outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, phone, message, attempts
+    """, (batch_size,))
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+def _send_sms(phone, message):
+    """Sends one SMS via Textbelt. Returns None on success, else an error string."""
+    api_key = os.environ.get("TEXTBELT_API_KEY")
+    if not api_key:
+        return "Missing TEXTBELT_API_KEY in environment"
+    try:
+        resp = get_http_session("notify").post(
+            TEXTBELT_ENDPOINT,
+            data={
+                "phone": phone,
+                "message": message,
+                "key": api_key,
+            },
+            timeout=10
+        )
+        data = resp.json()
+    except Exception as e:
+        return f"Exception while sending SMS via Textbelt: {e}"
+    if not data.get("success"):
+        return f"Textbelt failed: {data}"
+    return None
+
+def _record_result(outbox_id, attempts, error):
+    conn = db_connect()
+    try:
+        cur = conn.cursor()
+        if error is None:
+            cur.execute("""
+                UPDATE notification_outbox SET status = 'sent', sent_at = NOW(), last_error = NULL
+                WHERE id = %s
+            """, (outbox_id,))
+        else:
+            final = attempts >= NOTIFY_MAX_ATTEMPTS
+            cur.execute("""
+                UPDATE notification_outbox
+                SET status = %s, last_error = %s,
+                    next_attempt_at = NOW() + make_interval(secs => %s)
+                WHERE id = %s
+            """, ("failed" if final else "pending", error, 30 * 2 ** attempts, outbox_id))
+        conn.commit()
+        cur.close()
+    finally:
+        db_release(conn)
+
+def dispatch_pending(batch_size=NOTIFY_BATCH_SIZE):
+    """
+    Sends one batch of due notifications, paced to NOTIFY_SENDS_PER_SECOND.
+    Failures are retried with exponential backoff until NOTIFY_MAX_ATTEMPTS.
+    Returns the number of rows processed.
+    """
+    _ensure_outbox_table()
+    conn = db_connect()
+    try:
+        rows = _claim_batch(conn, batch_size)
+    finally:
+        db_release(conn)
+
+    # No connection is held while pacing or waiting on Textbelt; each result is
+    # written with its own short checkout so the pool stays free for jobs.
+    for i, (outbox_id, phone, message, attempts) in enumerate(rows):
+        if i:
+            time.sleep(1.0 / NOTIFY_SENDS_PER_SECOND)
+        error = _send_sms(phone, message)
+        if error is None:
+            print(f"📱 Notification {outbox_id} sent")
+        else:
+            final = attempts >= NOTIFY_MAX_ATTEMPTS
+            print(f"⚠️ Notification {outbox_id} attempt {attempts} failed{' (giving up)' if final else ''}: {error}")
+        _record_result(outbox_id, attempts, error)
+    return len(rows)
+
+def run_dispatcher(poll_seconds=NOTIFY_POLL_SECONDS):
+    """Dispatch loop: drains full batches back to back, otherwise polls."""
+    print("[INFO] Notification dispatcher started")
+    while True:
+        try:
+            processed = dispatch_pending()
+        except Exception as e:
+            print(f"[WARN] Notification dispatch failed: {e}")
+            processed = 0
+        if processed < NOTIFY_BATCH_SIZE:
+            time.sleep(poll_seconds)
+
+if __name__ == "__main__":
+    run_dispatcher()
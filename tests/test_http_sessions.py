@@ -0,0 +1,26 @@
+import gc
+
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+import clients
+
+
+def test_shared_session_survives_collected_auth_helper():
+    session = clients.get_http_session("spotify")
+    adapter = session.get_adapter("https://accounts.spotify.com")
+    adapter.poolmanager.connection_from_url("https://accounts.spotify.com")
+    assert len(adapter.poolmanager.pools) == 1
+
+    auth = SpotifyOAuth(
+        "client-id",
+        "client-secret",
+        "http://localhost/callback",
+        cache_handler=MemoryCacheHandler(),
+        requests_session=session
+    )
+    del auth
+    gc.collect()
+
+    assert len(adapter.poolmanager.pools) == 1
+    assert clients.get_http_session("spotify") is session
@@ -0,0 +1,48 @@
+import pytest
+
+import new_music
+
+
+class FakeLibrary:
+    """Stands in for a spotipy client: serves a saved-tracks library of `total` items."""
+
+    def __init__(self, total, failing_offsets=()):
+        self.total = total
+        self.failing_offsets = set(failing_offsets)
+        self.requested = []
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        self.requested.append(offset)
+        if offset in self.failing_offsets:
+            raise RuntimeError(f"boom at {offset}")
+        items = [
+            {"added_at": "2024-01-01T00:00:00Z", "track": {"artists": [{"id": f"a{i}", "name": f"A{i}"}]}}
+            for i in range(offset, min(offset + limit, self.total))
+        ]
+        return {"items": items, "total": self.total}
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(new_music.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(new_music, "BACKFILL_REQUESTS_PER_SECOND", 10000)
+
+
+@pytest.mark.parametrize("total", [0, 30, 50, 450, 451, 1000, 1049])
+def test_every_offset_fetched_once(total):
+    library = FakeLibrary(total)
+
+    pages = list(new_music._iter_saved_track_pages(library))
+
+    assert sorted(library.requested) == list(range(0, max(total, 1), 50))
+    assert sum(len(page["items"]) for page in pages) == total
+
+
+def test_failed_page_yields_none(monkeypatch):
+    monkeypatch.setattr(new_music, "BACKFILL_PAGE_RETRIES", 2)
+    library = FakeLibrary(500, failing_offsets={250})
+
+    pages = list(new_music._iter_saved_track_pages(library))
+
+    assert pages.count(None) == 1
+    assert library.requested.count(250) == 2